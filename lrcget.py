@@ -1,11 +1,11 @@
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
-from urllib.parse import (
-    quote, urlencode,
-)
-from urllib.request import (
-    Request, urlopen,
-)
+from pathlib import Path
+from urllib.parse import urlencode
 import os, json
+import threading
+import logging
 
 from PyQt5.QtNetwork import QNetworkRequest
 
@@ -19,13 +19,19 @@ from picard.ui.itemviews import (
     register_album_action,
 )
 
-from PyQt5 import QtWidgets
+from PyQt5 import QtCore, QtWidgets
 from picard.ui.options import (
     OptionsPage,
     register_options_page,
 )
 from picard.config import BoolOption
 
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
 PLUGIN_NAME = "LRCLIB Lyrics"
 PLUGIN_AUTHOR = "Glicole"
 PLUGIN_DESCRIPTION = (
@@ -46,154 +52,242 @@ PLUGIN_USER_GUIDE_URL = "https://github.com/izaz4141/picard-lrclib"
 lrclib_get_url = "https://lrclib.net/api/get"
 lrclib_search_url = "https://lrclib.net/api/search"
 
+# Mirror of the settings read on every file added to a track, refreshed
+# at load and whenever the options page is saved
+_SETTINGS_CACHE = {"search_on_load": False, "auto_overwrite": False, "save_lrc_file": True}
+
+# Sidecar writes run here so slow (network) disks don't block the UI.
+# A single worker keeps batches in flush order, so two batches never
+# write the same sidecar at once.
+_io_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lrclib-io")
+
+# ~dirname -> names of the sidecar files in it, dropped once an album settles
+_lrc_dir_cache = {}
+# normcased sidecar path -> writes queued for it that the worker hasn't done
+# yet; they count as existing files even after the scan above is dropped
+_unwritten_lrc = Counter()
+_unwritten_lock = threading.Lock()
+# (artist, title, album, duration) -> process_response contexts waiting on the same GET
+_inflight = {}
+# Most recent successful GET responses, served without touching the network
+_RESULT_CACHE = OrderedDict()
+_RESULT_CACHE_SIZE = 256
+# Search dialog query -> results, for re-running a search while tweaking it
+_SEARCH_CACHE = OrderedDict()
+_SEARCH_CACHE_SIZE = 64
+
+def _refresh_settings_cache():
+    for name in _SETTINGS_CACHE:
+        _SETTINGS_CACHE[name] = config.setting[name]
+
 def format_durasi(durasi: int) -> str:
-    durasi = int(durasi)
-    donat = durasi
-    if durasi >= 3600:
-        jam = durasi // 3600
-        donat = durasi % 3600
-    if donat >= 60:
-        menit = donat // 60
-        detik = donat % 60
-    else:
-        menit = 0
-        detik = donat
-
-    if durasi >= 3600:
+    menit, detik = divmod(int(durasi), 60)
+    jam, menit = divmod(menit, 60)
+    if jam:
         return f"{jam}:{menit:02}:{detik:02}"
-    else:
-        return f"{menit}:{detik:02}"
+    return f"{menit}:{detik:02}"
 
 def truncate_text(text, max_lines=5, max_chars_per_line=46):
-    lines = []
-    for i, line in enumerate(text.splitlines()):
-        if i >= max_lines:
-            lines[-1] = lines[-1].rstrip() + " …"
-            break
+    # Only split off the lines that can be shown, the rest stays in one piece
+    lines = text.split("\n", max_lines)
+    overflow = len(lines) > max_lines and lines.pop().strip("\r")
+    for i, line in enumerate(lines):
+        line = line.rstrip("\r")
         if len(line) > max_chars_per_line:
-            line = line[:max_chars_per_line - 1].rstrip() + "…"
-        lines.append(line)
-    if len(lines) > max_lines:
-        lines = lines[:max_lines]
-        lines[-1] = lines[-1].rstrip() + " …"
+            line = f"{line[:max_chars_per_line - 1].rstrip()}…"
+        lines[i] = line
+    if overflow:
+        lines[-1] = f"{lines[-1].rstrip()} …"
     return "\n".join(lines)
 
-def parse_duration(time_str:str):
-    parts = time_str.strip().split(":")
-    if not all(p.isdigit() for p in parts):
+def parse_duration(time_str:str) -> int:
+    rest, _, seconds = time_str.strip().rpartition(":")
+    hours, sep, minutes = rest.rpartition(":")
+    if not (seconds.isdigit() and minutes.isdigit() and (hours.isdigit() or not sep)):
         raise ValueError(f"Invalid time format: {time_str}")
 
-    if len(parts) == 2:
-        minutes, seconds = map(int, parts)
-        total_seconds = minutes * 60 + seconds
-    elif len(parts) == 3:
-        hours, minutes, seconds = map(int, parts)
-        total_seconds = hours * 60**2 + minutes * 60 + seconds
-    else:
-        raise ValueError(f"Unsupported time format: {time_str}")
+    total_seconds = int(minutes) * 60 + int(seconds)
+    if hours:
+        total_seconds += int(hours) * 60**2
 
     return total_seconds
 
+def _track_length(track):
+    length = track.metadata["~length"]
+    return parse_duration(length) if length else None
+
 
 
-def confirm_replace(parent, title, description):
+def confirm_replace(parent, title, description, all_files=False):
+    buttons = QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No
+    if all_files:
+        buttons |= QtWidgets.QMessageBox.YesToAll | QtWidgets.QMessageBox.NoToAll
     try:
         parent = QtWidgets.QApplication.activeWindow() if parent is None else parent
-        reply = QtWidgets.QMessageBox.question(
+        return QtWidgets.QMessageBox.question(
             parent,
             title,
             description,
-            QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No,
+            buttons,
             QtWidgets.QMessageBox.No
         )
-        return reply == QtWidgets.QMessageBox.Yes
     except Exception:
-        return False
+        return QtWidgets.QMessageBox.No
 
-def show_search_table(parent, query, response, request_callback):
-    parent = QtWidgets.QApplication.activeWindow() if parent is None else parent
-    dialog = QtWidgets.QDialog(parent)
-    dialog.setWindowTitle("Search Tracks")
-    dialog.resize(700, 400)
-
-    layout = QtWidgets.QVBoxLayout(dialog)
-
-    search_layout = QtWidgets.QHBoxLayout()
-    search_input = QtWidgets.QLineEdit()
-    search_input.setText(query)
-    search_input.setPlaceholderText("Enter search query...")
-    search_button = QtWidgets.QPushButton("Search")
-    search_layout.addWidget(search_input)
-    search_layout.addWidget(search_button)
-    layout.addLayout(search_layout)
-
-    table = QtWidgets.QTableWidget(dialog)
-    table.setColumnCount(5)
-    table.setHorizontalHeaderLabels(["Name", "Artist", "Length", "Album", "Synced"])
-    header = table.horizontalHeader()
-    header.setSectionResizeMode(0, QtWidgets.QHeaderView.Stretch)
-    header.setSectionResizeMode(1, QtWidgets.QHeaderView.Interactive)
-    header.setSectionResizeMode(2, QtWidgets.QHeaderView.ResizeToContents)
-    header.setSectionResizeMode(3, QtWidgets.QHeaderView.Interactive)
-    header.setSectionResizeMode(4, QtWidgets.QHeaderView.ResizeToContents)
-    table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
-    table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
-    table.setSelectionMode(QtWidgets.QAbstractItemView.SingleSelection)
-    layout.addWidget(table)
-
-    button_box = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel)
-    layout.addWidget(button_box)
-
-    def populate_table(response):
-        table.setRowCount(0)
-        if not response:
+class LrclibResultModel(QtCore.QAbstractTableModel):
+
+    HEADERS = ["Name", "Artist", "Length", "Album", "Synced"]
+
+    def __init__(self, rows=None, parent=None):
+        super().__init__(parent)
+        self._store(rows)
+
+    def _store(self, rows):
+        self.rows = rows or []
+        # Formatted once per result set, data() gets asked for these a lot
+        display = []
+        for item in self.rows:
+            g = item.get
+            display.append((
+                str(g("trackName", "")),
+                str(g("artistName", "")),
+                format_durasi(g("duration") or 0),
+                str(g("albumName", "")),
+                "✓" if g("syncedLyrics") else "✕",
+            ))
+        self._display = display
+
+    def set_rows(self, rows):
+        self.beginResetModel()
+        self._store(rows)
+        self.endResetModel()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole or not index.isValid():
+            return None
+        return self._display[index.row()][index.column()]
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+            return self.HEADERS[section]
+        return super().headerData(section, orientation, role)
+
+class LrclibSearchDialog(QtWidgets.QDialog):
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Search Tracks")
+        self.resize(700, 400)
+        self.request_callback = None
+        self.latest_query = None
+
+        layout = QtWidgets.QVBoxLayout(self)
+
+        search_layout = QtWidgets.QHBoxLayout()
+        self.search_input = QtWidgets.QLineEdit()
+        self.search_input.setPlaceholderText("Enter search query...")
+        self.search_button = QtWidgets.QPushButton("Search")
+        search_layout.addWidget(self.search_input)
+        search_layout.addWidget(self.search_button)
+        layout.addLayout(search_layout)
+
+        self.model = LrclibResultModel(parent=self)
+        self.table = QtWidgets.QTableView(self)
+        self.table.setModel(self.model)
+        header = self.table.horizontalHeader()
+        header.setSectionResizeMode(0, QtWidgets.QHeaderView.Stretch)
+        header.setSectionResizeMode(1, QtWidgets.QHeaderView.Interactive)
+        header.setSectionResizeMode(2, QtWidgets.QHeaderView.Interactive)
+        header.setSectionResizeMode(3, QtWidgets.QHeaderView.Interactive)
+        header.setSectionResizeMode(4, QtWidgets.QHeaderView.Interactive)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QtWidgets.QAbstractItemView.SingleSelection)
+        layout.addWidget(self.table)
+
+        button_box = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel)
+        layout.addWidget(button_box)
+
+        self.search_button.clicked.connect(self.on_search_clicked)
+        self.search_input.returnPressed.connect(self.on_search_clicked)
+        self.table.doubleClicked.connect(self.on_double_click)
+        button_box.accepted.connect(self.accept)
+        button_box.rejected.connect(self.reject)
+
+    def populate_table(self, response):
+        # Size the short columns once per result set rather than letting
+        # ResizeToContents re-measure every row on each layout pass
+        self.table.setUpdatesEnabled(False)
+        self.model.set_rows(response)
+        self.table.resizeColumnToContents(2)
+        self.table.resizeColumnToContents(4)
+        self.table.setUpdatesEnabled(True)
+
+    def on_search_response(self, searched, response):
+        if searched != self.latest_query:
+            return # the dialog was closed while the search was running
+        self.search_button.setEnabled(True)
+        if response is None:
             return
-        table.setRowCount(len(response))
-        for row, item in enumerate(response):
-            values = [
-                item.get("trackName", ""),
-                item.get("artistName", ""),
-                format_durasi(item.get("duration", 0)),
-                item.get("albumName", ""),
-                "✓" if item.get("syncedLyrics") else "✕",
-            ]
-            for col, val in enumerate(values):
-                table.setItem(row, col, QtWidgets.QTableWidgetItem(str(val)))
-
-    populate_table(response)
-
-    def on_search_clicked():
-        nonlocal response
-        query = search_input.text().strip()
-        if not query:
+        self.populate_table(response)
+        log.debug(f"Search refreshed: {len(response)} results")
+
+    def on_search_clicked(self):
+        query = self.search_input.text().strip()
+        if not query or self.request_callback is None or not self.search_button.isEnabled():
             return
+        self.latest_query = query
+        self.search_button.setEnabled(False)
         try:
-            params = {"q": query}
-            response = request_callback(lrclib_search_url, params)
-            populate_table(response)
-            log.debug(f"Search refreshed: {len(response)} results")
+            self.request_callback(query, partial(self.on_search_response, query))
         except Exception as e:
+            self.search_button.setEnabled(True)
             log.error(f"Error during search refresh: {e}")
 
-    search_button.clicked.connect(on_search_clicked)
-    search_input.returnPressed.connect(on_search_clicked)
-
-    def on_double_click(index):
+    def on_double_click(self, index):
         if index.isValid():
-            dialog.accept()
-
-    table.doubleClicked.connect(on_double_click)
+            self.accept()
+
+    def run(self, query, response, request_callback):
+        self.request_callback = request_callback
+        self.latest_query = query
+        self.search_input.setText(query)
+        self.search_button.setEnabled(True)
+        self.populate_table(response)
+        try:
+            if self.exec_() != QtWidgets.QDialog.Accepted:
+                return None
+            selected = self.table.currentIndex().row()
+            return self.model.rows[selected] if selected >= 0 else None
+        finally:
+            self.request_callback = None
+            self.latest_query = None
+            self.model.set_rows([])
+
+_search_dialog = None
+
+def _get_search_dialog(parent):
+    global _search_dialog
+    if _search_dialog is None or _search_dialog.parent() is not parent:
+        _search_dialog = LrclibSearchDialog(parent)
+    elif _search_dialog.isVisible():
+        # Another search is still open, stack a throwaway dialog on top of it
+        return LrclibSearchDialog(parent)
+    return _search_dialog
 
-    button_box.accepted.connect(dialog.accept)
-    button_box.rejected.connect(dialog.reject)
+def show_search_table(parent, query, response, request_callback):
+    parent = QtWidgets.QApplication.activeWindow() if parent is None else parent
+    return _get_search_dialog(parent).run(query, response, request_callback)
 
-    result = dialog.exec_()
-    if result == QtWidgets.QDialog.Accepted:
-        selected = table.currentRow()
-        return response[selected] if selected >= 0 else None
-    else:
-        return None
 
+def _debug_enabled():
+    return log.main_logger.isEnabledFor(logging.DEBUG)
 
 def _request(ws, url, callback, queryargs=None, important=False):
     if not queryargs:
@@ -201,101 +295,287 @@ def _request(ws, url, callback, queryargs=None, important=False):
 
     ws.get_url(
         url=url,
-        handler=callback,
-        parse_response_type="json",
+        handler=partial(_parse_response, callback),
+        parse_response_type=None,
         priority=True,
         important=important,
         queryargs=queryargs,
         cacheloadcontrol=QNetworkRequest.PreferCache,
     )
 
-def _fetch_json(url, params):
+def _parse_response(callback, document, reply, error):
+    # Replies arrive as raw bytes so they can go through orjson when present
+    response = None
+    if not error:
+        try:
+            response = _loads(bytes(document))
+        except ValueError as e:
+            log.error(f"{PLUGIN_NAME}: invalid JSON from LRCLIB: {e}")
+            error = e
+    callback(response, reply, error)
+
+def _search_request(ws, query, handler):
+    cached = _SEARCH_CACHE.get(query)
+    if cached is not None:
+        _SEARCH_CACHE.move_to_end(query)
+        QtCore.QTimer.singleShot(0, partial(handler, cached))
+        return
+
+    def callback(response, reply, error):
+        if error or not isinstance(response, list):
+            log.error(f"{PLUGIN_NAME}: search for {query!r} failed: {error}")
+            handler(None)
+            return
+        _SEARCH_CACHE[query] = response
+        if len(_SEARCH_CACHE) > _SEARCH_CACHE_SIZE:
+            _SEARCH_CACHE.popitem(last=False)
+        handler(response)
+
+    _request(ws, lrclib_search_url, callback, {"q": query})
+
+
+def _sidecar_names(dirname):
+    names = _lrc_dir_cache.get(dirname)
+    if names is None:
+        names = set()
+        try:
+            with os.scandir(dirname) as entries:
+                for entry in entries:
+                    name = os.path.normcase(entry.name)
+                    if name.endswith((".lrc", ".txt")):
+                        names.add(name)
+        except OSError as e:
+            log.debug(f"{PLUGIN_NAME}: Failed to scan {dirname}: {e}")
+        _lrc_dir_cache[dirname] = names
+    return names
+
+def _finish_request(album):
+    album._requests -= 1
+    album._finalize_loading(None)
+    if not album._requests:
+        _lrc_dir_cache.clear()
+        album._lrclib_overwrite_policy = None
+
+def _queue_lrc_write(album, path, data, overwrite):
+    pending = getattr(album, "_lrclib_pending", None)
+    if pending is None:
+        pending = album._lrclib_pending = []
+        album._lrclib_orig_finalize = album._finalize_loading
+        album._finalize_loading = partial(_finalize_loading, album)
+    with _unwritten_lock:
+        _unwritten_lrc[os.path.normcase(path)] += 1
+    pending.append((path, data, overwrite))
+
+def _is_unwritten(path):
+    with _unwritten_lock:
+        return os.path.normcase(path) in _unwritten_lrc
+
+def _mark_written(path):
+    key = os.path.normcase(path)
+    with _unwritten_lock:
+        _unwritten_lrc[key] -= 1
+        if _unwritten_lrc[key] <= 0:
+            del _unwritten_lrc[key]
+
+def _finalize_loading(album, error):
+    if album._requests == 0:
+        _flush_lrc_writes(album)
+    album._lrclib_orig_finalize(error)
+
+def _flush_lrc_writes(album):
+    pending = album._lrclib_pending
+    if not pending:
+        return
+    album._lrclib_pending = []
+    # Group writes by directory so each folder is touched in one go
+    pending.sort(key=lambda item: os.path.dirname(item[0]))
+    _io_pool.submit(_write_lrc_files, pending)
+
+def _write_lrc_files(pending):
+    for path, data, overwrite in pending:
+        try:
+            _write_lrc_file(path, data, overwrite)
+        finally:
+            _mark_written(path)
+
+def _write_lrc_file(path, data, overwrite):
+    # Only truncate sidecars we decided to replace, never one that
+    # showed up after the directory was scanned
+    flags = os.O_WRONLY | os.O_CREAT | getattr(os, "O_BINARY", 0)
+    flags |= os.O_TRUNC if overwrite else os.O_EXCL
+    try:
+        fd = os.open(path, flags, 0o644)
+    except FileExistsError:
+        log.warning(f"{PLUGIN_NAME}: {path} was created by someone else, not overwriting it")
+        return
+    except Exception as e:
+        log.error(f"{PLUGIN_NAME}: Failed to write {path}: {e}")
+        return
     try:
-        query = urlencode(params)
-        full_url = f"{url}?{query}"
-
-        req = Request(full_url, headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/140.0.0.0 Safari/537.36"})
-        with urlopen(req, timeout=10) as resp:
-            if resp.status != 200:
-                log.error(f"{PLUGIN_NAME}: HTTP error {resp.status} for {full_url}")
-                return {}
-            data = resp.read().decode("utf-8")
-            return json.loads(data)
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
     except Exception as e:
-        log.error(f"{PLUGIN_NAME}: fetch_json: failed to request {url} — {e}")
-        return {}
+        log.error(f"{PLUGIN_NAME}: Failed to write {path}: {e}")
+    finally:
+        os.close(fd)
 
 
-def get_lyrics(method, album, metadata, linked_files, length=None):
+def _lyrics_query(metadata, length):
     artist = metadata["artist"]
     title = metadata["title"]
     albumName = metadata["album"]
-    duration = int(length)
-    if not (artist and title and albumName and duration):
-        log.debug(
-            "{}: artist, title, album name, and duration are required to obtain lyrics".format(
-                PLUGIN_NAME
-            )
-        )
-        return
+    if not (length and artist and title and albumName):
+        log.debug("%s: artist, title, album name, and duration are required to obtain lyrics", PLUGIN_NAME)
+        return None
 
     queryargs = {
         "track_name": title,
         "artist_name": artist,
         "album_name": albumName,
+        "duration": length,
     }
-    if duration:
-        queryargs["duration"] = duration
+    return (artist, title, albumName, length), queryargs
+
+def get_lyrics(method, album, metadata, linked_files, length=None):
+    query = _lyrics_query(metadata, length)
+    if query is None:
+        return
     album._requests += 1
-    log.debug(
-        "{}: GET {}?{}".format(PLUGIN_NAME, quote(lrclib_get_url), urlencode(queryargs))
-    )
+    _send_get(method, album, metadata, linked_files, *query)
+
+def _send_get(method, album, metadata, linked_files, key, queryargs):
+    # The caller has already counted this request in album._requests
+    context = (method, album, metadata, linked_files)
+
+    cached = _RESULT_CACHE.get(key)
+    if cached is not None:
+        _RESULT_CACHE.move_to_end(key)
+        log.debug("%s: GET served from memory for %s", PLUGIN_NAME, key)
+        # Still answer from the event loop, like a network reply would
+        QtCore.QTimer.singleShot(0, partial(process_response, *context, cached, None, None))
+        return
+    if key in _inflight:
+        _inflight[key].append(context)
+        log.debug("%s: GET already pending for %s", PLUGIN_NAME, key)
+        return
+    _inflight[key] = [context]
+    if _debug_enabled():
+        log.debug("%s: GET %s?%s", PLUGIN_NAME, lrclib_get_url, urlencode(queryargs))
     _request(
         album.tagger.webservice, lrclib_get_url,
-        partial(process_response, method, album, metadata, linked_files),
+        partial(_dispatch_response, key),
         queryargs,
     )
 
+def _dispatch_response(key, response, reply, error):
+    if not error and isinstance(response, dict) and response.get("id"):
+        _RESULT_CACHE[key] = response
+        if len(_RESULT_CACHE) > _RESULT_CACHE_SIZE:
+            _RESULT_CACHE.popitem(last=False)
+    for context in _inflight.pop(key, ()):
+        # One reply serves several tracks; a failure on one must not leave
+        # the others' albums loading forever
+        try:
+            process_response(*context, response, reply, error)
+        except Exception:
+            log.error(f"{PLUGIN_NAME}: failed to process response for {key}", exc_info=True)
+
 def search_lyrics(method, album, metadata, linked_files):
     artist = metadata["artist"]
     title = metadata["title"]
     albumName = metadata["album"]
     if not (artist and title and albumName):
-        log.debug(
-            "{}: artist, title, album name, and duration are required to obtain lyrics".format(
-                PLUGIN_NAME
-            )
-        )
+        log.debug("%s: artist, title, album name, and duration are required to obtain lyrics", PLUGIN_NAME)
         return
 
     queryargs = {
         "q": title,
     }
     album._requests += 1
-    log.debug(
-        "{}: SEARCH {}?{}".format(PLUGIN_NAME, quote(lrclib_search_url), urlencode(queryargs))
-    )
-    _request(
-        album.tagger.webservice, lrclib_search_url,
-        partial(process_response, method, album, metadata, linked_files),
-        queryargs,
-    )
+    if _debug_enabled():
+        log.debug("%s: SEARCH %s?%s", PLUGIN_NAME, lrclib_search_url, urlencode(queryargs))
+    def callback(response, reply, error, _m=method, _a=album, _md=metadata, _lf=linked_files):
+        return process_response(_m, _a, _md, _lf, response, reply, error)
+
+    _request(album.tagger.webservice, lrclib_search_url, callback, queryargs)
+
+def _lyrics_not_found(metadata):
+    log.warning('%s: lyrics NOT found for track "%s" by %s', PLUGIN_NAME, metadata["title"], metadata["artist"])
+
+def _store_lyrics(album, md, lyrics, lyrics_bytes, ext, base_path, stem, sidecars, has_lrc_file, save_lrc, from_sidecar=False):
+    md["lyrics"] = lyrics
+    if save_lrc:
+        for old_ext in [".txt", ".lrc"]:
+            old_file = base_path + old_ext
+            if old_ext != ext and stem + old_ext in sidecars:
+                try:
+                    os.remove(old_file)
+                    sidecars.discard(stem + old_ext)
+                except Exception as e:
+                    log.error(f"{PLUGIN_NAME}: Failed to delete {old_file}: {e}")
+
+        if not from_sidecar:
+            _queue_lrc_write(album, base_path + ext, lyrics_bytes, has_lrc_file or stem + ext in sidecars)
+            sidecars.add(stem + ext)
+
+def _ask_overwrite(album, file, md, lyrics, all_files):
+    title = "Overwrite file lyrics?"
+    desc = (
+        'Overwrite Lyrics for "{}".\n\n'
+        "{}"
+    ).format(md.get("title", "<file>"), truncate_text(lyrics, 5, 42))
+    parent = getattr(file, "tagger", None)
+    reply = confirm_replace(getattr(parent, "window", None), title, desc, all_files)
+    if reply in (QtWidgets.QMessageBox.YesToAll, QtWidgets.QMessageBox.NoToAll):
+        album._lrclib_overwrite_policy = reply == QtWidgets.QMessageBox.YesToAll
+    return reply in (QtWidgets.QMessageBox.Yes, QtWidgets.QMessageBox.YesToAll)
+
+def _resolve_overwrite(album, item):
+    # The message box runs a nested event loop, so other tracks' replies are
+    # processed while it is open. They queue up in album._lrclib_deferred
+    # instead of stacking their own prompts, and are settled here in turn.
+    queue = album._lrclib_deferred = [(item, None)]
+    album._lrclib_prompting = True
+    try:
+        while queue:
+            (file, md, *store_args), deferred = queue.pop(0)
+            try:
+                # A "to all" answer holds until the album's pending lookups are done
+                accepted = getattr(album, "_lrclib_overwrite_policy", None)
+                if accepted is None:
+                    lyrics = store_args[0]
+                    accepted = _ask_overwrite(album, file, md, lyrics, album._requests > 1 or bool(queue))
+                if accepted:
+                    _store_lyrics(album, md, *store_args)
+            except Exception:
+                log.error(f"{PLUGIN_NAME}: lyrics NOT loaded for {md.get('title', '<file>')}", exc_info=True)
+            finally:
+                # The request that queued this can only finish once all of
+                # its files are settled
+                if deferred is not None:
+                    deferred[0] -= 1
+                    if not deferred[0]:
+                        _finish_request(album)
+    finally:
+        album._lrclib_prompting = False
 
 def process_response(method, album, metadata, linked_files, response, reply, error):
-    if error or (response and isinstance(response, dict) and not response.get("id", False)):
-        album._requests -= 1
-        album._finalize_loading(None)
-        log.warning(
-            '{}: lyrics NOT found for track "{}" by {}'.format(
-                PLUGIN_NAME, metadata["title"], metadata["artist"]
-            )
-        )
-        return
-
+    # Files of this track waiting on another track's overwrite prompt
+    deferred = [0]
     try:
+        if error:
+            _lyrics_not_found(metadata)
+            return
+        # GET answers with a single record, search with a list of them
+        if isinstance(response, dict) and "id" not in response:
+            _lyrics_not_found(metadata)
+            return
+
         if method == "search":
             parent = album.tagger.window if hasattr(album, "tagger") else None
-            response = show_search_table(parent, metadata["title"], response, _fetch_json)
+            request_callback = partial(_search_request, album.tagger.webservice)
+            response = show_search_table(parent, metadata["title"], response, request_callback)
             if response is None:
                 return
 
@@ -316,55 +596,53 @@ def process_response(method, album, metadata, linked_files, response, reply, err
         if not lyrics:
             return
 
+        save_lrc = config.setting["save_lrc_file"]
+        auto_overwrite = config.setting["auto_overwrite"]
+        is_search_on_load = method == "search_on_load"
+        ext = ".txt" if (is_plain and config.setting["plain_as_txt"]) else ".lrc"
+        lyrics_bytes = lyrics.encode("utf-8")
+        targets = []
         for file in linked_files:
-            ext = ".txt" if (is_plain and config.setting["plain_as_txt"]) else ".lrc"
-            base_path = f"{file.metadata['~dirname']}/{file.metadata['~filename']}"
-            file_lrc = f"{base_path}{ext}"
+            md = file.metadata
+            dirname = md['~dirname']
+            filename = md['~filename']
+            targets.append((file, md, dirname, os.path.join(dirname, filename), os.path.normcase(filename)))
+
+        for file, md, dirname, base_path, stem in targets:
+            file_lrc = base_path + ext
+            sidecars = _sidecar_names(dirname)
             
-            has_metadata_lyrics = bool(file.metadata.get("lyrics"))
-            has_lrc_file = os.path.exists(file_lrc)
+            has_metadata_lyrics = bool(md.get("lyrics"))
+            # A sidecar still waiting on the worker exists as far as we're concerned
+            has_lrc_file = stem + ext in sidecars or _is_unwritten(file_lrc)
+            from_sidecar = False
             
-            if has_metadata_lyrics and not has_lrc_file and config.setting["save_lrc_file"]:
-                lyrics = file.metadata.get("lyrics")
+            if has_metadata_lyrics and not has_lrc_file and save_lrc:
+                lyrics = md.get("lyrics")
+                lyrics_bytes = lyrics.encode("utf-8")
             elif has_lrc_file and not has_metadata_lyrics:
                 try:
-                    with open(file_lrc, "r") as f:
-                        lyrics = f.read()
+                    lyrics = Path(file_lrc).read_text(encoding="utf-8", errors="replace")
+                    lyrics_bytes = lyrics.encode("utf-8")
+                    from_sidecar = True
                 except Exception as e:
                     log.error(f"{PLUGIN_NAME}: Failed to read existing .lrc file: {e}")
             elif (has_metadata_lyrics and has_lrc_file \
-                or has_metadata_lyrics and not config.setting["save_lrc_file"]) \
-                and not config.setting["auto_overwrite"]:
+                or has_metadata_lyrics and not save_lrc) \
+                and not auto_overwrite:
 
-                if method == "search_on_load":
+                if is_search_on_load:
                     return
+                item = (file, md, lyrics, lyrics_bytes, ext, base_path, stem, sidecars, has_lrc_file, save_lrc)
+                if getattr(album, "_lrclib_prompting", False):
+                    deferred[0] += 1
+                    album._lrclib_deferred.append((item, deferred))
                 else:
-                    title = "Overwrite file lyrics?"
-                    desc = (
-                        'Overwrite Lyrics for "{}".\n\n'
-                        "{}"
-                    ).format(file.metadata.get("title", "<file>"), truncate_text(lyrics, 5, 42))
-                    parent = getattr(file, "tagger", None)
-                    if not confirm_replace(getattr(parent, "window", None), title, desc):
-                        return
-
-            file.metadata["lyrics"] = lyrics
-            if config.setting["save_lrc_file"]:
-                for old_ext in [".txt", ".lrc"]:
-                    old_file = base_path + old_ext
-                    if os.path.exists(old_file):
-                        try:
-                            os.remove(old_file)
-                        except Exception as e:
-                            log.error(f"{PLUGIN_NAME}: Failed to delete {old_file}: {e}")
-                
-                with open(file_lrc, "w") as f:
-                    f.write(lyrics)
-        log.debug(
-            '{}: lyrics loaded for track "{}" by {}'.format(
-                PLUGIN_NAME, metadata["title"], metadata["artist"]
-            )
-        )
+                    _resolve_overwrite(album, item)
+                continue
+
+            _store_lyrics(album, md, lyrics, lyrics_bytes, ext, base_path, stem, sidecars, has_lrc_file, save_lrc, from_sidecar)
+        log.debug('%s: lyrics loaded for track "%s" by %s', PLUGIN_NAME, metadata["title"], metadata["artist"])
 
     except (TypeError, KeyError, ValueError):
         log.error(
@@ -375,8 +653,8 @@ def process_response(method, album, metadata, linked_files, response, reply, err
         )
 
     finally:
-        album._requests -= 1
-        album._finalize_loading(None)
+        if not deferred[0]:
+            _finish_request(album)
 
 
 class LrclibLyricsOptionsPage(OptionsPage):
@@ -387,10 +665,11 @@ class LrclibLyricsOptionsPage(OptionsPage):
     
     AUDIO_EXTENSIONS = {
         'aac', 'ac3', 'aif', 'aifc', 'aiff', 'ape', 'asf', 'dff', 'dsf', 
-        'eac3', 'flac', 'kar', 'm2a', 'ofr', 'ofs', 'oga', 'ogg', 'oggflac', 
+        'eac3', 'flac', 'kar', 'm2a', 'm4a', 'mp3', 'mpc', 'ofr', 'ofs', 'oga', 'ogg', 'oggflac', 
         'oggtheora', 'ogv', 'ogx', 'opus', 'spx', 'tak', 'tta', 'wav', 'webm', 
         'wma', 'wmv', 'wv', 'xwma'
     }
+    AUDIO_SUFFIXES = tuple("." + ext for ext in AUDIO_EXTENSIONS)
 
     options = [
         BoolOption("setting", "search_on_load", False),
@@ -457,6 +736,7 @@ class LrclibLyricsOptionsPage(OptionsPage):
         config.setting["save_lrc_file"] = self.save_lrc.isChecked()
         config.setting["ignore_instrumental"] = self.ignore_instrumental.isChecked()
         config.setting["plain_as_txt"] = self.plain_as_txt.isChecked()
+        _refresh_settings_cache()
     
     def clean_orphaned_lrc_files(self):
         try:
@@ -501,72 +781,120 @@ class LrclibLyricsOptionsPage(OptionsPage):
         
         orphaned_count = 0
         
-        try:
-            for dirpath, dirnames, filenames in os.walk(root_dir):
-                lrc_files = [f for f in filenames if f.lower().endswith('.lrc')]
-                
-                for lrc_file in lrc_files:
-                    lrc_path = os.path.join(dirpath, lrc_file)
-                    base_name = os.path.splitext(lrc_file)[0]
-                    
-                    audio_file_exists = False
-                    for ext in self.AUDIO_EXTENSIONS:
-                        audio_path = os.path.join(dirpath, base_name + ext)
-                        if os.path.exists(audio_path):
-                            audio_file_exists = True
-                            break
-                    
-                    if not audio_file_exists:
-                        try:
-                            os.remove(lrc_path)
-                            orphaned_count += 1
-                            log.debug(f"{PLUGIN_NAME}: Deleted orphaned file: {lrc_path}")
-                        except Exception as e:
-                            log.error(f"{PLUGIN_NAME}: Failed to delete {lrc_path}: {e}")
-        
-        except Exception as e:
-            log.error(f"{PLUGIN_NAME}: Error scanning directory {root_dir}: {e}")
+        pending_dirs = [root_dir]
+        while pending_dirs:
+            dirpath = pending_dirs.pop()
+            try:
+                audio_bases = set()
+                lrc_files = []
+                with os.scandir(dirpath) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending_dirs.append(entry.path)
+                            continue
+                        name = entry.name.lower()
+                        if name.endswith(".lrc"):
+                            lrc_files.append((entry.path, name[:-4]))
+                        elif name.endswith(self.AUDIO_SUFFIXES):
+                            audio_bases.add(name.rpartition(".")[0])
+            except Exception as e:
+                log.error(f"{PLUGIN_NAME}: Error scanning directory {dirpath}: {e}")
+                continue
+
+            for lrc_path, base_name in lrc_files:
+                if base_name not in audio_bases:
+                    try:
+                        os.remove(lrc_path)
+                        orphaned_count += 1
+                        log.debug(f"{PLUGIN_NAME}: Deleted orphaned file: {lrc_path}")
+                    except Exception as e:
+                        log.error(f"{PLUGIN_NAME}: Failed to delete {lrc_path}: {e}")
         
         return orphaned_count
 
 def search_on_load(track, file):
-    if not config.setting["search_on_load"]:
+    if not _SETTINGS_CACHE["search_on_load"]:
         return
     try:
         if not track.linked_files:
             return
-        length = None
-        if track.metadata["~length"]:
-            length = parse_duration(track.metadata["~length"])
+        # Without overwriting or .lrc files, tagged lyrics are left untouched,
+        # so there is nothing to fetch for them
+        if not (_SETTINGS_CACHE["auto_overwrite"] or _SETTINGS_CACHE["save_lrc_file"]) \
+            and all(f.metadata.get("lyrics") for f in track.linked_files):
+            return
+        length = _track_length(track)
         get_lyrics("search_on_load", track.album, track.metadata, track.linked_files, length)
     except Exception as err:
         log.error(f"{PLUGIN_NAME}: Error in search_on_load: {err}")
 
-class LrcLibLyricsGet(BaseAction):
+class LrcLibLyricsAction(BaseAction):
+
+    def __init__(self):
+        super().__init__()
+        # type -> bound handler, resolved once per type with issubclass so
+        # subclasses such as NonAlbumTrack keep working
+        self._handlers = {}
+
+    def _handler_for(self, cls):
+        if issubclass(cls, Track):
+            return self._handle_track
+        if issubclass(cls, Album):
+            return self.execute_on_album
+        return None
+
+    def _handle_track(self, track):
+        log.debug("%s: %s, %s", PLUGIN_NAME, track, track.album)
+        self.execute_on_track(track)
+
+    def execute_on_album(self, album):
+        for track in album.tracks:
+            log.debug("%s: %s, %s", PLUGIN_NAME, track, album)
+            self.execute_on_track(track)
+
+    def callback(self, objs):
+        handlers = self._handlers
+        for item in objs:
+            cls = type(item)
+            try:
+                handler = handlers[cls]
+            except KeyError:
+                handler = handlers[cls] = self._handler_for(cls)
+            if handler is not None:
+                handler(item)
+
+class LrcLibLyricsGet(LrcLibLyricsAction):
     NAME = "Get lyrics automatically with LRCLIB"
 
     def execute_on_track(self, track):
         try:
             if not track.linked_files: # If it's not in your local file then ignore
                 return
-            length = None
-            if track.metadata["~length"]:
-                length = parse_duration(track.metadata["~length"])
+            length = _track_length(track)
             get_lyrics("get", track.album, track.metadata, track.linked_files, length)
         except Exception as err:
             log.error(err)
 
-    def callback(self, objs):
-        for item in (t for t in objs if isinstance(t, Track) or isinstance(t, Album)):
-            if isinstance(item, Track):
-                log.debug("{}: {}, {}".format(PLUGIN_NAME, item, item.album))
-                self.execute_on_track(item)
-            elif isinstance(item, Album):
-                for track in item.tracks:
-                    log.debug("{}: {}, {}".format(PLUGIN_NAME, track, item))
-                    self.execute_on_track(track)
-
-class LrcLibLyricsSearch(BaseAction):
+    def execute_on_album(self, album):
+        queries = []
+        for track in album.tracks:
+            log.debug("%s: %s, %s", PLUGIN_NAME, track, album)
+            if not track.linked_files: # If it's not in your local file then ignore
+                continue
+            try:
+                query = _lyrics_query(track.metadata, _track_length(track))
+            except Exception as err:
+                log.error(err)
+                continue
+            if query is not None:
+                queries.append((track, query))
+
+        # Count the whole album up front, then send everything in one burst
+        album._requests += len(queries)
+        for track, query in queries:
+            _send_get("get", album, track.metadata, track.linked_files, *query)
+
+class LrcLibLyricsSearch(LrcLibLyricsAction):
     NAME = "Search lyrics manually with LRCLIB"
 
     def execute_on_track(self, track):
@@ -577,20 +905,13 @@ class LrcLibLyricsSearch(BaseAction):
         except Exception as err:
             log.error(err)
 
-    def callback(self, objs):
-        for item in (t for t in objs if isinstance(t, Track) or isinstance(t, Album)):
-            if isinstance(item, Track):
-                log.debug("{}: {}, {}".format(PLUGIN_NAME, item, item.album))
-                self.execute_on_track(item)
-            elif isinstance(item, Album):
-                for track in item.tracks:
-                    log.debug("{}: {}, {}".format(PLUGIN_NAME, track, item))
-                    self.execute_on_track(track)
-
 
+_refresh_settings_cache()
 register_file_post_addition_to_track_processor(search_on_load)
-register_track_action(LrcLibLyricsSearch())
-register_album_action(LrcLibLyricsSearch())
-register_track_action(LrcLibLyricsGet())
-register_album_action(LrcLibLyricsGet())
+_search_action = LrcLibLyricsSearch()
+_get_action = LrcLibLyricsGet()
+register_track_action(_search_action)
+register_album_action(_search_action)
+register_track_action(_get_action)
+register_album_action(_get_action)
 register_options_page(LrclibLyricsOptionsPage)